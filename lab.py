@@ -2,8 +2,13 @@
 import doctest
 from text_tokenize import tokenize_sentences
 
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
 
 class Trie:
+    # no per-instance __dict__, tries over a whole book have many thousands of nodes
+    __slots__ = ('value', 'key_type', 'children')
+
     def __init__(self, key_type):
         self.value = None
         self.key_type = key_type
@@ -20,14 +25,26 @@ class Trie:
         wrong type.
         """
         self._valid_key(key)
+        cur_trie = self._get_node(key)
+        if cur_trie is None:
+            raise KeyError(f'Given key, {key}, was not found in the Trie')
+        return cur_trie
+
+    def _get_node(self, key):
+        """
+        Returns the trie at the inputed key, or None if the key does not exist
+        in the trie. Does not check the type of the key and never raises, so
+        lookups that often miss don't pay for an exception.
+        """
+        is_tuple = self.key_type == tuple
         cur_trie = self
         for k in key:
-            if self.key_type == tuple:
+            if is_tuple:
                 k = (k,)
-            if k in cur_trie.children:
-                cur_trie = cur_trie.children[k]
-            else:
-                raise KeyError(f'Given key, {key}, was not found in the Trie')
+            # a single probe of the children dict per step of the descent
+            cur_trie = cur_trie.children.get(k)
+            if cur_trie is None:
+                return None
         return cur_trie
 
     def __setitem__(self, key, value):
@@ -38,22 +55,26 @@ class Trie:
         the wrong type.
         """
         self._valid_key(key)
-        cur_key = key[0]
-        if self.key_type == tuple:
-            cur_key = (key[0],)    
-        if not cur_key in self.children:
-            # create new Trie instance
-            cur = Trie(self.key_type)
-            self.children[cur_key] = cur
-        else:
-            # grab the existing Trie instance at this key
-            cur = self.children[cur_key]
-        if len(key) == 1:
-            # if it is the last value in the key, then set the value of this Trie
-            self.children[cur_key].value = value
-        else:
-            # recursively call, set item again with rest of key
-            cur[key[1:]] = value
+        self._setitem_unchecked(key, value)
+
+    def _setitem_unchecked(self, key, value):
+        """
+        Same as setting trie[key] = value, but without checking the type of the
+        key, for callers that already know it matches the key type of the trie.
+        """
+        is_tuple = self.key_type == tuple
+        cur_trie = self
+        for k in key:
+            if is_tuple:
+                k = (k,)
+            child = cur_trie.children.get(k)
+            if child is None:
+                # create new Trie instance
+                child = Trie(self.key_type)
+                cur_trie.children[k] = child
+            cur_trie = child
+        # the last value in the key, so set the value of this Trie
+        cur_trie.value = value
 
     def __getitem__(self, key):
         """
@@ -96,29 +117,51 @@ class Trie:
         >>> 'bar' in t
         True
         """
-        try:
-            t = self._find_trie(key)
-            if t.value == None:
-                return False
-            return True
-        except KeyError:
-            return False
-    
-    def recursive_generator(self, key, trie):
-        if trie.value != None:
-            yield (key, trie.value)
-        for k, t in trie.children.items():
-            yield from self.recursive_generator(key+k, trie.children[k])
+        self._valid_key(key)
+        t = self._get_node(key)
+        return t is not None and t.value is not None
 
     def __iter__(self):
         """
         Generator of (key, value) pairs for all keys/values in this trie and
         its children.  Must be a generator!
         """
-        if self.key_type == tuple:
-            yield from self.recursive_generator((), self)
+        yield from walk_trie(self)
+
+
+def walk_trie(trie):
+    """
+    Generator of (key, value) pairs for all keys/values in the given trie and
+    its children, walking them without any recursion
+    """
+    if trie.key_type == tuple:
+        make_key = tuple
+    else:
+        make_key = ''.join
+    if trie.value is not None:
+        yield (make_key(()), trie.value)
+    # depth first walk with an explicit stack of children iterators, each
+    # paired with the length of the key of the trie they belong to, while path
+    # holds the elements of the key for the trie being visited
+    path = []
+    stack = [(iter(trie.children.items()), 0)]
+    while stack:
+        children, depth = stack[-1]
+        for k, t in children:
+            del path[depth:]
+            path.extend(k)
+            # follow chains of tries with a single child and no value straight
+            # down, without putting each of them on the stack
+            while t.value is None and len(t.children) == 1:
+                (k, t), = t.children.items()
+                path.extend(k)
+            if t.value is not None:
+                yield (make_key(path), t.value)
+            if t.children:
+                stack.append((iter(t.children.items()), len(path)))
+            break
         else:
-            yield from self.recursive_generator('', self)
+            stack.pop()
 
 
 def make_word_trie(text):
@@ -132,24 +175,33 @@ def make_word_trie(text):
     >>> t['code']
     3
     """
-    word_trie = Trie(str)
-    sentences = tokenize_sentences(text)
+    return make_word_trie_from_sentences(tokenize_sentences(text))
+
+def make_word_trie_from_sentences(sentences):
+    """
+    Same as make_word_trie, but takes the already tokenized sentences of the
+    text so they can be shared with make_phrase_trie_from_sentences
+    >>> sentences = tokenize_sentences("code code and more code")
+    >>> t = make_word_trie_from_sentences(sentences)
+    >>> t['code']
+    3
+    """
+    # count the words first so each distinct word is only inserted once
+    counts = {}
     for s in sentences:
         for w in s.split(" "):
-            if w in word_trie:
-                word_trie[w] += 1
-            else:
-                word_trie[w] = 1
+            counts[w] = counts.get(w, 0) + 1
+    # the words all come from splitting strings, so their type doesn't need checking
+    word_trie = Trie(str)
+    for w, count in counts.items():
+        word_trie._setitem_unchecked(w, count)
     return word_trie
 
 def get_sentence_tuple(sentence):
     """
     Takes in a sentence and returns a tuple of the words in that sentence
     """
-    sent_tuple = ()
-    for word in sentence.split(" "):
-        sent_tuple += (word,)
-    return sent_tuple
+    return tuple(sentence.split(" "))
 
 def make_phrase_trie(text):
     """
@@ -162,14 +214,29 @@ def make_phrase_trie(text):
     >>> t[('i', 'like', 'french', 'toast')]
     1
     """
-    phrase_trie = Trie(tuple)
-    sentences = tokenize_sentences(text)
+    return make_phrase_trie_from_sentences(tokenize_sentences(text))
+
+def make_phrase_trie_from_sentences(sentences):
+    """
+    Same as make_phrase_trie, but takes the already tokenized sentences of the
+    text so they can be shared with make_word_trie_from_sentences
+    >>> sentences = tokenize_sentences("I like waffles. I like french toast.")
+    >>> t = make_phrase_trie_from_sentences(sentences)
+    >>> t[('i', 'like', 'waffles')]
+    1
+    """
+    # count the sentences first so each distinct sentence is only inserted once
+    counts = {}
+    # every occurrence of a word shares one string object, so comparing the words
+    # of two keys in the trie is an identity check and no word is stored twice
+    words = {}
     for s in sentences:
-        sent_tuple = get_sentence_tuple(s)
-        if sent_tuple in phrase_trie:
-            phrase_trie[sent_tuple] += 1
-        else:
-            phrase_trie[sent_tuple] = 1
+        sent_tuple = tuple(words.setdefault(w, w) for w in get_sentence_tuple(s))
+        counts[sent_tuple] = counts.get(sent_tuple, 0) + 1
+    # the sentences are all built as tuples, so their type doesn't need checking
+    phrase_trie = Trie(tuple)
+    for sent_tuple, count in counts.items():
+        phrase_trie._setitem_unchecked(sent_tuple, count)
     return phrase_trie
 
 def autocomplete(trie, prefix, max_count=None):
@@ -195,42 +262,25 @@ def autocomplete(trie, prefix, max_count=None):
     """
     try:
         t = trie._find_trie(prefix)
-        # iterates over the words that have the prefix and saves them in a frequency map with the key being
-        # the value of that word in the trie and the key's value is a set of the words that have the same count
-        freq_map = {}
-        max_freq = None
-        for e in t:
-            count = e[1]
-            if count in freq_map:
-                freq_map[count] |= { e[0] }
-            else:
-                freq_map[count] = { e[0] }
-            if not max_freq or count > max_freq:
-                max_freq = count
-        # starting from the highest frequency count of a word seen in the trie with the prefix, it loops from
-        # there down, adding words to the element list until it reaches the size of max_count or runs out of words
-        # if max_count is not set
-        element_list = []
-        for i in range(max_freq, 0, -1):
-            if i in freq_map:
-                for w in freq_map[i]:
-                    if max_count == None or len(element_list) < max_count:
-                        element_list.append(prefix+w)
-                    else:
-                        break
-        return element_list
     except KeyError:
-        # if the prefix isn't in the trie, then find trie raises a keyerrro and it returns an empty array
+        # if the prefix isn't in the trie, then find trie raises a keyerror and it returns an empty array
         return []
+    # orders the words that have the prefix from most to least frequent in a single
+    # sort and keeps only the first max_count of them if max_count is set
+    elements = sorted(t, key=lambda e: e[1], reverse=True)
+    if max_count != None:
+        elements = elements[:max_count]
+    return [prefix+w for w, _ in elements]
 
 def get_single_insertions(prefix):
     """
     Yields all possible single-character insertions (add any one character in the range "a" to "z" at any place in the word)
     """
-    letters = 'abcdefghijklmnopqrstuvwxyz'
+    # slice the prefix once for each position rather than once for each letter
     for i in range(len(prefix)+1):
-        for l in letters:
-            yield prefix[:i] + l + prefix[i:]
+        left, right = prefix[:i], prefix[i:]
+        for l in LETTERS:
+            yield left + l + right
 
 def get_single_deletions(prefix):
     """
@@ -243,10 +293,11 @@ def get_single_replacement(prefix):
     """
     Yields all possible single-character replacements (replace any one character in the word with a character in the range a-z)
     """
-    letters = 'abcdefghijklmnopqrstuvwxyz'
+    # slice the prefix once for each position rather than once for each letter
     for i in range(len(prefix)):
-        for l in letters:
-            yield prefix[:i] + l + prefix[i+1:]
+        left, right = prefix[:i], prefix[i+1:]
+        for l in LETTERS:
+            yield left + l + right
 
 def get_two_char_transpose(prefix):
     """
@@ -286,64 +337,103 @@ def autocorrect(trie, prefix, max_count=None):
     if max_count == None or len(element_list) < max_count:
         # gets most-frequently-occuring valid edits of the prefix until the length of 
         # the element list hits max count or gets all if max count is not set
-        freq_map = {}
-        max_freq = None
+        edits = []
         used_words = set(element_list)
-        # loop over possible edits of the prefix
-        for word in get_edits(prefix):
-            # if they are valid, then add them to the freq map
-            if not word in used_words and word in trie:
-                count = trie[word]
-                if count in freq_map:
-                    freq_map[count] |= { word }
-                else:
-                    freq_map[count] = { word }
-                if not max_freq or count > max_freq:
-                    max_freq = count
-        # loop over the values in the freq map starting from the highest count and going down
-        for i in range(max_freq, 0, -1):
-            if i in freq_map:
-                for w in freq_map[i]:
-                    # add elements to list until size of element list hits max_count or until
-                    # it runs out of words if max_count is not set
-                    if max_count == None or len(element_list) < max_count:
-                        element_list.append(w)
-                    else:
-                        break
+        used_words.add(prefix)
+        # loop over the distinct possible edits of the prefix, keeping the order they
+        # were generated in
+        for word in dict.fromkeys(get_edits(prefix)):
+            if word in used_words:
+                continue
+            # if they are valid, then save them with their count, looking each one up
+            # in the trie only once. the words are already distinct, so a list is enough
+            t = trie._get_node(word)
+            if t != None and t.value != None:
+                edits.append((word, t.value))
+        # order the valid edits from highest count to lowest and add them to the list
+        # until size of element list hits max_count or until it runs out of words if
+        # max_count is not set
+        edits.sort(key=lambda e: e[1], reverse=True)
+        if max_count != None:
+            del edits[max_count - len(element_list):]
+        element_list.extend(w for w, _ in edits)
     return element_list
     
-def search(trie, pattern, word):
-    """
-    Recursive search function for finding words that match the pattern
-    Returns a set of words that match pattern
-    """
-    if not pattern:
-        if word in trie:
-            return {(word, trie[word])}
-        return set()
-    matches = set()
-    if pattern[0] == "*":
-        # remove any immediately following * to prevent it from adding in the same word multiple times
-        while len(pattern) > 1 and pattern[1] == '*':
-            pattern = pattern[1:]
-        # no char works
-        matches |= search(trie, pattern[1:], word)
-        # and all next chars work
-        for c in trie._find_trie(word).children:
-            matches |= search(trie, pattern, word+c)
-            if len(pattern) > 1 and c == pattern[1]:
-                matches |= search(trie, pattern[1:], word+c)
-    elif pattern[0] == "?":
-        # must have a next char which can be anything
-        for c in trie._find_trie(word).children:
-            matches |= search(trie, pattern[1:], word+c)
-    else:
-        # p is a specific char
-        try:
-            if trie._find_trie(word+pattern[0]):
-                matches |= search(trie, pattern[1:], word+pattern[0])
-        except KeyError:
-            pass
+def pattern_closure(pattern, positions):
+    """
+    Returns the given positions in pattern as a frozenset, along with the
+    position after each * since a * can also match no characters. Assumes
+    there are no runs of * in the pattern
+    """
+    closed = set(positions)
+    for i in positions:
+        if i < len(pattern) and pattern[i] == "*":
+            closed.add(i+1)
+    return frozenset(closed)
+
+def pattern_step(pattern, state, c):
+    """
+    Returns the state with the positions in pattern that can be reached from
+    the positions in state by matching the char c
+    """
+    positions = set()
+    for i in state:
+        if i < len(pattern):
+            p = pattern[i]
+            if p == "*":
+                # * takes the char and can keep taking more
+                positions.add(i)
+            elif p == "?" or p == c:
+                positions.add(i+1)
+    return pattern_closure(pattern, positions)
+
+def pattern_chars(pattern, state):
+    """
+    Returns the set of chars that can be matched from state, or None if a * or
+    ? in state can match any char
+    """
+    chars = set()
+    for i in state:
+        if i < len(pattern):
+            if pattern[i] == "*" or pattern[i] == "?":
+                return None
+            chars.add(pattern[i])
+    return chars
+
+def search(trie, pattern):
+    """
+    Search function for finding words that match the pattern by walking the
+    trie once. Each word on the way has a state, the set of positions in the
+    pattern it can have matched up to, and the word matches when the end of the
+    pattern is in its state. The states and the moves between them make up a
+    DFA which is built lazily while walking and shared by all the nodes, and
+    the walk stops going down as soon as a word's state is empty
+    Returns a list of words that match pattern. Every node is visited only
+    once, so no word is in the list twice
+    """
+    end = len(pattern)
+    moves = {}
+    chars_of = {}
+    matches = []
+    stack = [(trie, "", pattern_closure(pattern, {0}))]
+    while stack:
+        node, word, state = stack.pop()
+        if end in state and node.value != None:
+            matches.append((word, node.value))
+        if state not in chars_of:
+            chars_of[state] = pattern_chars(pattern, state)
+        chars = chars_of[state]
+        if chars is None:
+            children = node.children.items()
+        else:
+            # only specific chars can match, so look them up instead of trying every child
+            children = [(c, node.children[c]) for c in chars if c in node.children]
+        for c, child in children:
+            next_state = moves.get((state, c))
+            if next_state is None:
+                next_state = moves[(state, c)] = pattern_step(pattern, state, c)
+            if next_state:
+                stack.append((child, word+c, next_state))
     return matches
 
 
@@ -365,8 +455,12 @@ def word_filter(trie, pattern, word=None, seen=None):
     >>> ('bar', 1) in f and ('bark', 1) in f and len(f) == 2
     True
     """
-    matches = search(trie, pattern, "")
-    return list(matches)
+    # collapse runs of * into a single * once up front, since they match the same words
+    collapsed = ''
+    for p in pattern:
+        if p != '*' or not collapsed.endswith('*'):
+            collapsed += p
+    return search(trie, collapsed)
 
 
 # you can include test cases of your own in the block below.
@@ -397,11 +491,13 @@ if __name__ == '__main__':
     # with open("text_files/alices_adventures.txt", encoding="utf-8") as f:
     #     text = f.read()
 
-    #     phrase_trie = make_phrase_trie(text)
+    #     # tokenize once and build both tries from the same sentences
+    #     sentences = tokenize_sentences(text)
+    #     phrase_trie = make_phrase_trie_from_sentences(sentences)
     #     # six_most_common_sent = autocomplete(phrase_trie, (), 6)
     #     # print(six_most_common_sent)
 
-    #     # word_trie = make_word_trie(text)
+    #     # word_trie = make_word_trie_from_sentences(sentences)
     #     # top_12_autocorrects = autocorrect(word_trie, "hear", 12)
     #     # print(top_12_autocorrects)
 